@@ -21,7 +21,7 @@
 # build-in module
 import os
 import sys
-from multiprocessing import Pool
+from multiprocessing import Pool, cpu_count
 
 # third-party modules
 import numpy
@@ -31,6 +31,8 @@ from medpy.core.logger import Logger
 from .exceptions import TaskExecutionError
 
 # constants
+CPU_COUNT = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else cpu_count()
+"""The number of processors available to this process (respecting its CPU affinity)."""
 
 # code
 class TaskMachine (object):
@@ -46,7 +48,7 @@ class TaskMachine (object):
         multiprocessing : bool
             Enable/disable multiprocessing.
         nprocesses : int or None
-            The number of processes to spawn. If ``None``, the number corresponds to the processor count.
+            The number of processes to spawn. If ``None``, the number corresponds to `CPU_COUNT`.
         """
         self.logger = Logger.getInstance()
         self.tasks = []
@@ -73,6 +75,15 @@ class TaskMachine (object):
             Short description of the task.
         """
         self.tasks.append([required_files, generated_files, callback_function, args, kwargs, description])
+        
+    @property
+    def nworkers(self):
+        r"""
+        The maximum number of tasks executed concurrently.
+        """
+        if not self.multiprocessing:
+            return 1
+        return self.nprocesses if self.nprocesses else CPU_COUNT
     
     def run(self):
         r"""
@@ -83,7 +94,7 @@ class TaskMachine (object):
         tasks = [[tid + 1] + task for tid, task in enumerate(self.tasks)]
         # execute tasks (multiprocessing or sequential)
         if self.multiprocessing:
-            pool = Pool(self.nprocesses)
+            pool = Pool(self.nworkers)
             pool.map(_runtask, tasks)
         else:
             for task in tasks:
@@ -19,11 +19,15 @@
 # status Development
 
 # build-in module
+from multiprocessing.pool import ThreadPool
 
 # third-party modules
 import numpy
 from medpy.io import load, save
-from medpy.features.utilities import join
+try:
+    from numba import njit
+except ImportError:
+    njit = None
 
 # own modules
 from .. import TaskMachine, FileSet
@@ -31,6 +35,8 @@ from .. import TaskMachine, FileSet
 # constants
 PROBABILITY_THRESHOLD = 0.5
 """The probability of belonging to the foreground a voxel must reach to be considered object."""
+PREDICTION_CHUNK_SIZE = 1 << 20
+"""The number of voxels passed to the forest at once."""
 
 # code
 def applyforest(directory, forest, featureset, brainmasks):
@@ -82,23 +88,90 @@ def applyforest(directory, forest, featureset, brainmasks):
 
 def __applyforest(forest, featurefiles, brainmaskfile, segmentationfile, probabilityfile):
     r"""Apply a forest using the features and save the results."""
-    # memory-efficient loading of the features for this case
-    features = join(*[numpy.load(featurefile, mmap_mode='r') for featurefile in featurefiles])
-    if 1 == features.ndim:
-        features = numpy.expand_dims(features, -1)
+    # memory-efficient access to the features for this case
+    featurearrays = [numpy.load(featurefile, mmap_mode='r') for featurefile in featurefiles]
     
-    # apply forest
-    probability_results = forest.predict_proba(features)[:,1]
-    classification_results = probability_results > PROBABILITY_THRESHOLD # equivalent to forest.predict
-    
-    # create result image
+    # prepare result images (the voxels outside the mask stay below the threshold)
     m, h = load(brainmaskfile)
-    m = m.astype(numpy.bool)
-    oc = numpy.zeros(m.shape, numpy.uint8)
+    m = m.astype(numpy.bool_, copy=False)
     op = numpy.zeros(m.shape, numpy.float32)
-    oc[m] = numpy.squeeze(classification_results).ravel()
-    op[m] = numpy.squeeze(probability_results).ravel()
+    
+    # apply forest
+    if njit is not None:
+        # stream the probabilities chunk-wise directly into the result images
+        oc = numpy.zeros(m.shape, numpy.uint8)
+        mflat, ocflat, opflat = numpy.ravel(m), oc.ravel(), op.ravel()
+        position = 0
+        for probabilities in _iterproba(forest, featurearrays):
+            position = _scatterthreshold(mflat, probabilities, PROBABILITY_THRESHOLD, ocflat, opflat, position)
+    else:
+        op[m] = _predictproba(forest, featurearrays)
+        oc = numpy.empty(m.shape, numpy.uint8)
+        numpy.greater(op, PROBABILITY_THRESHOLD, out=oc.view(numpy.bool_)) # equivalent to forest.predict
 
     # saving the results
     save(oc, segmentationfile, h)
     save(op, probabilityfile, h)
+
+def _scatterthreshold(mask, probabilities, threshold, oc, op, position):
+    r"""
+    Scatter the ``probabilities`` into the flat ``op`` and their thresholded values
+    into the flat ``oc`` at the next positions of the flat ``mask``, starting the
+    search at ``position``. Returns the position following the last written voxel.
+    """
+    i = position
+    j = 0
+    while j < probabilities.shape[0]:
+        if mask[i]:
+            op[i] = probabilities[j]
+            oc[i] = probabilities[j] > threshold # equivalent to forest.predict
+            j += 1
+        i += 1
+    return i
+if njit is not None:
+    _scatterthreshold = njit(cache=True)(_scatterthreshold)
+
+def _predictproba(forest, featurearrays):
+    r"""
+    Compute the foreground probabilities of all voxels, collecting them in a
+    pre-allocated float32 array.
+    """
+    probabilities = numpy.empty(featurearrays[0].shape[0], numpy.float32)
+    start = 0
+    for chunk in _iterproba(forest, featurearrays):
+        probabilities[start:start + len(chunk)] = chunk
+        start += len(chunk)
+    return probabilities
+
+def _iterproba(forest, featurearrays):
+    r"""
+    Yield the foreground probabilities chunk-wise as float32 arrays. The next chunk
+    of features is loaded in a background thread while the forest is applied to the
+    current one.
+    """
+    nvoxels = featurearrays[0].shape[0]
+    pool = ThreadPool(1)
+    try:
+        nextchunk = pool.apply_async(_loadfeatures, (featurearrays, 0, PREDICTION_CHUNK_SIZE))
+        for start in range(0, nvoxels, PREDICTION_CHUNK_SIZE):
+            stop = start + PREDICTION_CHUNK_SIZE
+            features = nextchunk.get()
+            if stop < nvoxels:
+                nextchunk = pool.apply_async(_loadfeatures, (featurearrays, stop, stop + PREDICTION_CHUNK_SIZE))
+            yield forest.predict_proba(features)[:,1].astype(numpy.float32)
+    finally:
+        pool.close()
+        pool.join()
+
+def _loadfeatures(featurearrays, start, stop):
+    r"""
+    Load the rows ``start`` to ``stop`` of the memory-mapped per-image feature arrays
+    of a case into a single, pre-allocated float32 2D array.
+    """
+    ncolumns = [1 if 1 == fa.ndim else fa.shape[1] for fa in featurearrays]
+    features = numpy.empty((len(featurearrays[0][start:stop]), sum(ncolumns)), numpy.float32)
+    offset = 0
+    for fa, nc in zip(featurearrays, ncolumns):
+        features[:,offset:offset + nc] = fa[start:stop].reshape(-1, nc)
+        offset += nc
+    return features
@@ -19,10 +19,10 @@
 # status Development
 
 # build-in module
-import itertools
 import os
 
 # third-party modules
+import nibabel
 from medpy.io import save, load
 
 # own modules
@@ -60,18 +60,35 @@ def correctbiasfields(directory, inset, brainmasks):
     # prepare output
     resultset = FileSet.fromfileset(directory, inset)
         
-    # register bias-field correction tasks
-    for case, identifier in itertools.product(inset.cases, inset.identifiers):
-        src = inset.getfile(case=case, identifier=identifier)
-        dest = resultset.getfile(case=case, identifier=identifier)
+    # register bias-field correction tasks (one per case, sharing the brain mask)
+    for case in inset.cases:
+        srcs = inset.getfiles(case=case)
+        dests = resultset.getfiles(case=case)
         brainmaskfile = brainmasks.getfile(case=case)
-        tm.register([src, brainmaskfile], [dest], _correctbiasfield, [src, dest, brainmaskfile], dict(), 'bias-field')
+        tm.register(srcs + [brainmaskfile], dests, _correctbiasfields, [srcs, dests, brainmaskfile], dict(), 'bias-field')
                 
     # run
     tm.run()
                 
     return resultset
         
+def _correctbiasfields(srcs, dests, bmask):
+    r"""
+    Correct the bias fields of all images of a case, one after another.
+    
+    Parameters
+    ----------
+    srcs : sequence of strings
+        Paths to the images to correct.
+    dests : sequence of strings
+        Target locations for the bias-field corrected images.
+    bmask : string
+        A binary image where the non-zero values denote the area over which to
+        compute the bias fields.
+    """
+    for src, dest in zip(srcs, dests):
+        _correctbiasfield(src, dest, bmask)
+        
 def _correctbiasfield(src, dest, bmask):
     r"""
     Correct the bias field of an image.
@@ -101,6 +118,17 @@ def _correctniftiheader(image):
     Correct the NIfTI header meta-data of a file in-place.
     This is usually required after an application of CMTK, as this screwes up the header.
     """
+    # uncompressed NIfTI files: patch the header in-place, leaving the image data untouched
+    if image.endswith('.nii'):
+        img = nibabel.load(image)
+        hdr = img.header
+        aff = img.affine
+        hdr.set_qform(aff, code=1)
+        hdr.set_sform(aff, code=1)
+        with open(image, 'r+b') as f:
+            f.write(hdr.binaryblock)
+        return
+    
     # correct the NIfTI header meta-data (it gets screwed up by cmtk)
     i, h = load(image)
     aff = get_affine(h)
@@ -19,27 +19,35 @@
 # status Development
 
 # build-in module
+import math
 import pickle
+from multiprocessing.pool import ThreadPool
 
 # third-party modules
 import numpy
+from scipy.ndimage import gaussian_filter
 from medpy.io import load, header, save
 from medpy.core import Logger
-from medpy.features.utilities import join, append
-from medpy.features.intensity import intensities, local_mean_gauss,\
-    local_histogram, centerdistance_xdminus1
+from medpy.features import intensity
+from medpy.features.intensity import intensities, local_mean_gauss
 
 # own modules
 from .. import TaskMachine, FileSet
+from ..TaskMachine import CPU_COUNT
+from ..utilities import load_mask
 from ..exceptions import InvalidConfigurationError
 
 # constants (see end of file for more constants)
 FEATURE_DTYPE = numpy.float32
 """The dtype the feature values should take."""
+TRAINING_DTYPE = FEATURE_DTYPE
+"""The default dtype of the sampled training set."""
 SAMPLEPOINT_FG_VALUE = 1
 """The value to denote FG samples in the sample point image."""
 SAMPLEPOINT_BG_VALUE = 2
 """The value to denote FG samples in the sample point image."""
+_maskfeaturecache = dict()
+"""Per-process cache of the mask-only features computed for the last brain mask."""
 
 # code
 def extractfeatures(directory, inset, brainmasks, groundtruth = False):
@@ -78,99 +86,161 @@ def extractfeatures(directory, inset, brainmasks, groundtruth = False):
         classes = False
     
         
-    # register feature extraction tasks
+    # register feature extraction tasks (one per image; the first image of each case
+    # additionally saves the feature names)
     for case in inset.cases:
         brainmaskfile = brainmasks.getfile(case=case)
         fndestfile = fnames.getfile(case=case)
+        for iid, (imagefile, destfile) in enumerate(zip(inset.getfiles(case=case), resultset.getfiles(case=case))):
+            if 0 == iid:
+                tm.register([imagefile, brainmaskfile], [destfile, fndestfile], _extract, [imagefile, destfile, brainmaskfile, fndestfile], dict(), 'feature-extraction')
+            else:
+                tm.register([imagefile, brainmaskfile], [destfile], _extract, [imagefile, destfile, brainmaskfile], dict(), 'feature-extraction')
         if groundtruth:
             groundtruthfile = groundtruth.getfile(case=case)
             cmdestfile = classes.getfile(case=case)
-            tm.register(inset.getfiles(case=case) + [brainmaskfile, groundtruthfile],
-                        resultset.getfiles(case=case) + [cmdestfile, fndestfile],
-                        _extract,
-                        [inset.getfiles(case=case), resultset.getfiles(case=case), brainmaskfile, fndestfile, groundtruthfile, cmdestfile],
-                        dict(),
-                        'feature-extraction')
-        else:
-            tm.register(inset.getfiles(case=case) + [brainmaskfile],
-                        resultset.getfiles(case=case) + [fndestfile],
-                        _extract,
-                        [inset.getfiles(case=case), resultset.getfiles(case=case), brainmaskfile, fndestfile],
-                        dict(),
-                        'feature-extraction')            
+            tm.register([brainmaskfile, groundtruthfile], [cmdestfile], _extractclassmemberships, [brainmaskfile, groundtruthfile, cmdestfile], dict(), 'class-memberships')
         
     # run
     tm.run()
         
     return resultset, classes, fnames
         
-def _extract(imagefiles, destfiles, brainmaskfile, fndestfile, groundtruthfile = False, cmdestfile = False):
+def _extract(imagefile, destfile, brainmaskfile, fndestfile = False):
     r"""
     Extract all features from the supplied image.
     
     Parameters
     ----------
-    imagefiles : sequence of strings
-        The images from which to extract the features.
-    destfiles : sequence of strings
-        The file in which to save the extracted features per images.
+    imagefile : string
+        The image from which to extract the features.
+    destfile : string
+        The file in which to save the extracted features.
     brainmaskfile : string
         The corresponding brain mask.
-    fndestfile : string
-        The destination file for the feature names.        
-    groundtruthfile : string
-        The corresponding ground-truth file.
-    cmdestfile : string
-        The destination file for the class memberships.
+    fndestfile : string or False
+        The destination file for the feature names. If ``False``, they are not saved.
     """
-    # loading the support images
-    msk = load(brainmaskfile)[0].astype(numpy.bool)
-    if groundtruthfile: gt = load(groundtruthfile)[0].astype(numpy.bool)
+    # loading the support image
+    msk = load_mask(brainmaskfile)
     
-    # for each pair of image and destination files
-    for imagefile, destfile in zip(imagefiles, destfiles):
-        
-        # prepare feature vector and the feature identification list
-        feature_vector = None
-        feature_names = []        
+    # prepare feature vector (written directly to the destination file) and the feature identification list
+    feature_vector = numpy.lib.format.open_memmap(destfile, mode='w+', dtype=FEATURE_DTYPE, shape=(numpy.count_nonzero(msk), len(FEATURE_NAMES)))
+    feature_column = 0
+    smoothed = None
+    
+    # load the image
+    img, hdr = load(imagefile)
+    
+    # iterate the features to extract
+    for function_call, function_arguments, voxelspacing in FEATURE_CONFIG:
         
-        # load the image
-        img, hdr = load(imagefile)
+        # extract the feature
+        call_arguments = list(function_arguments)
+        if voxelspacing: call_arguments.append(header.get_pixel_spacing(hdr))
+        call_arguments.append(msk)
+        if function_call in MASK_ONLY_FEATURES:
+            fv = _maskfeature(brainmaskfile, img, function_call, call_arguments)
+        elif local_mean_gauss == function_call:
+            smoothed = _gausscascade(img, smoothed, *call_arguments[:2])
+            fv = smoothed[1][msk]
+        else:
+            fv = function_call(img, *call_arguments)
         
-        # iterate the features to extract
-        for function_call, function_arguments, voxelspacing in FEATURE_CONFIG:
+        # write into the images feature vector
+        if fv.ndim > 1:
+            feature_vector[:,feature_column:feature_column + fv.shape[1]] = fv
+        else:
+            feature_vector[:,feature_column] = fv
+        feature_column += _nfeatures(function_call, function_arguments)
+    
+    # flush the extracted feature vector
+    feature_vector.flush()
+    del feature_vector
+    
+    # save the feature names
+    if fndestfile:
+        with open(fndestfile, 'wb') as f:
+            pickle.dump(FEATURE_NAMES, f)
             
-            # extract the feature
-            call_arguments = list(function_arguments)
-            if voxelspacing: call_arguments.append(header.get_pixel_spacing(hdr))
-            call_arguments.append(msk)
-            fv = function_call(img, *call_arguments)
+def _featurenames():
+    r"""The names of the feature columns produced by ``FEATURE_CONFIG``."""
+    feature_names = []
+    for function_call, function_arguments, _ in FEATURE_CONFIG:
+        if centerdistance_xdminus1 == function_call and not numpy.isscalar(function_arguments[0]):
+            feature_names.extend(['{}.{}'.format(function_call.__name__, d) for d in function_arguments[0]])
+            continue
+        feature_name = '{}.{}'.format(function_call.__name__, '_'.join(map(str, function_arguments)))
+        nfeatures = _nfeatures(function_call, function_arguments)
+        if nfeatures > 1:
+            feature_names.extend(['{}.{}'.format(feature_name, i) for i in range(nfeatures)])
+        else:
+            feature_names.append(feature_name)
+    return feature_names
+
+def _gausscascade(image, previous, sigma, voxelspacing):
+    r"""
+    Gaussian smoothing of ``image`` with ``sigma`` (in mm), as done by
+    `medpy.features.intensity.local_mean_gauss`, i.e. in the image's own dtype.
+    
+    If ``previous``, a ``(sigma, smoothed)`` tuple as returned by an earlier call,
+    holds a smoothing with a smaller sigma and the image is of floating point type,
+    only the difference ``sqrt(sigma**2 - previous_sigma**2)`` is applied to it. This
+    deviates from medpy's direct smoothing only by the truncation and sampling of the
+    discrete kernels and by floating point rounding. Integer images, whose smoothings
+    medpy truncates to integers, are always smoothed directly and match exactly.
+    
+    Returns
+    -------
+    sigma, smoothed : float, ndarray
+        The sigma and the smoothed image.
+    """
+    if previous is not None and previous[0] < sigma and numpy.issubdtype(image.dtype, numpy.floating):
+        base, sigma_ = previous[1], math.sqrt(sigma**2 - previous[0]**2)
+    else:
+        base, sigma_ = image, sigma
+    return sigma, gaussian_filter(base, [sigma_ / float(s) for s in voxelspacing])
+
+def _nfeatures(function_call, function_arguments):
+    r"""The number of feature columns produced by a ``FEATURE_CONFIG`` entry."""
+    if local_histogram == function_call:
+        return function_arguments[0]
+    elif centerdistance_xdminus1 == function_call and not numpy.isscalar(function_arguments[0]):
+        return len(function_arguments[0])
+    return 1
+
+def _maskfeature(brainmaskfile, img, function_call, call_arguments):
+    r"""
+    Compute a feature that depends only on the image shape, the voxel spacing and the
+    brain mask, or return it from the per-process cache if already computed for another
+    image of the same case. Only the features of the last brain mask are kept.
+    """
+    key = (brainmaskfile, img.shape, function_call.__name__, tuple(call_arguments[:-1]))
+    if not key in _maskfeaturecache:
+        if not any(brainmaskfile == k[0] for k in _maskfeaturecache):
+            _maskfeaturecache.clear()
+        _maskfeaturecache[key] = function_call(img, *call_arguments)
+    return _maskfeaturecache[key]
             
-            # append to the images feature vector
-            if feature_vector is None:
-                feature_vector = fv
-            else:
-                feature_vector = join(feature_vector, fv)
-                
-            # create and save feature names
-            feature_name = '{}.{}'.format(function_call.__name__, '_'.join(map(str, function_arguments)))
-            if fv.ndim > 1:
-                feature_names.extend(['{}.{}'.format(feature_name, i) for i in range(fv.shape[0])])
-            else:
-                feature_names.append(feature_name)
-        
-        # save the extracted feature vector and the feature names
-        with open(destfile, 'wb') as f:
-            numpy.save(f, feature_vector.astype(FEATURE_DTYPE))
+def _extractclassmemberships(brainmaskfile, groundtruthfile, cmdestfile):
+    r"""
+    Extract the class memberships of the voxels inside the brain mask.
     
-    # save the feature names (only once, at the end)
-    with open(fndestfile, 'wb') as f:
-        pickle.dump(feature_names, f)
-        
-    # save the class memberships (truncated by the brain mask)
-    if groundtruthfile:
-        with open(cmdestfile, 'wb') as f:
-            pickle.dump(gt[msk], f)
+    Parameters
+    ----------
+    brainmaskfile : string
+        The corresponding brain mask.
+    groundtruthfile : string
+        The corresponding ground-truth file.
+    cmdestfile : string
+        The destination file for the class memberships.
+    """
+    msk = load_mask(brainmaskfile)
+    gt = load(groundtruthfile)[0]
+    
+    # save the class memberships (truncated by the brain mask, in C-order as the features)
+    with open(cmdestfile, 'wb') as f:
+        numpy.save(f, numpy.compress(msk.ravel(), gt.ravel()).astype(numpy.bool_, copy=False))
 
 def sample(directory, features, classes, brainmasks, sampler, **kwargs):
     r"""
@@ -227,7 +297,7 @@ def sample(directory, features, classes, brainmasks, sampler, **kwargs):
     return resultset, samplepointset
 
         
-def stratifiedrandomsampling(featureclassquadrupel, trainingsetfile, classsetfile, nsamples = 500000, min_no_of_samples_per_class_and_case = 20):
+def stratifiedrandomsampling(featureclassquadrupel, trainingsetfile, classsetfile, nsamples = 500000, min_no_of_samples_per_class_and_case = 20, dtype = TRAINING_DTYPE):
     r"""
     Extract a training sample set from the supplied feature sets using stratified random sampling.
     
@@ -244,6 +314,9 @@ def stratifiedrandomsampling(featureclassquadrupel, trainingsetfile, classsetfil
         The amount of samples to draw. If False, all are drawn.
     min_no_of_samples_per_class_and_case : int
         An Exception is raised, when less this amount of samples are drawn from for class of a case.
+    dtype : numpy.dtype
+        The dtype in which to store the training set. Pass ``numpy.float16`` to halve
+        its size on disk and in memory.
     
     Raises
     ------
@@ -259,82 +332,188 @@ def stratifiedrandomsampling(featureclassquadrupel, trainingsetfile, classsetfil
     nsamplescase = int(nsamples / ncases)
     logger.debug('drawing {} samples from {} cases each (total {} samples)'.format(nsamplescase, ncases, nsamples))
     
-    # initialize collectors
-    fg_samples = []
-    bg_samples = []
-    
-    for cid, (featurefiles, classfile, brainmaskfile, featurepointfile) in enumerate(featureclassquadrupel):
-        
-        # adapt samples to draw from last case to draw a total of nsamples
-        if len(featureclassquadrupel) - 1 == cid:
-            nsamplescase += nsamples % ncases
-        
-        # load the class memberships
-        classes = numpy.load(classfile, mmap_mode='r') 
-        
-        # determine number of fg and bg samples to draw for this case
-        nbgsamples = int(float(numpy.count_nonzero(~classes)) / classes.size * nsamplescase)
-        nfgsamples = int(float(numpy.count_nonzero(classes)) / classes.size * nsamplescase)
-        nfgsamples += nsamplescase - (nfgsamples + nbgsamples) # +/- a little
-        logger.debug('iteration {}: drawing {} fg and {} bg samples'.format(cid, nfgsamples, nbgsamples))
-        
-        # check for exceptions
-        if nfgsamples < min_no_of_samples_per_class_and_case: raise InvalidConfigurationError('Current setting would lead to a drawing of only {} fg samples for case {}!'.format(nfgsamples, classfile))
-        if nbgsamples < min_no_of_samples_per_class_and_case: raise InvalidConfigurationError('Current setting would lead to a drawing of only {} bg samples for case {}!'.format(nbgsamples, classfile))
-        if nfgsamples > numpy.count_nonzero(classes):
-            raise InvalidConfigurationError('Current settings would require to draw {} fg samples, but only {} present for case {}!'.format(nfgsamples, numpy.count_nonzero(classes), classfile))
-        if nbgsamples > numpy.count_nonzero(~classes):
-            raise InvalidConfigurationError('Current settings would require to draw {} bg samples, but only {} present for case {}!'.format(nbgsamples, numpy.count_nonzero(~classes), classfile))
-        
-        # get sample indices and split into fg and bg indices
-        samples_indices = numpy.arange(len(classes))
-        fg_samples_indices = samples_indices[classes]
-        bg_samples_indices = samples_indices[~classes]
-        
-        # randomly draw the required number of sample indices
-        numpy.random.shuffle(fg_samples_indices)
-        numpy.random.shuffle(bg_samples_indices)
-        fg_sample_selection = fg_samples_indices[:nfgsamples]
-        bg_sample_selection = bg_samples_indices[:nbgsamples]
-        
-        # memory-efficient loading of the features for this case
-        features = join(*[numpy.load(featurefile, mmap_mode='r') for featurefile in featurefiles])
-        
-        # draw and add to collection
-        fg_samples.append(features[fg_sample_selection])
-        bg_samples.append(features[bg_sample_selection])
-        
-        # create and save sample point file
-        mask, maskh = load(brainmaskfile)
-        mask = mask.astype(numpy.bool)
-        featurepointimage = numpy.zeros_like(mask, numpy.uint8)
-        featurepointimage = _setimagepointstwofilter(featurepointimage, mask, fg_sample_selection, SAMPLEPOINT_FG_VALUE)
-        featurepointimage = _setimagepointstwofilter(featurepointimage, mask, bg_sample_selection, SAMPLEPOINT_BG_VALUE)
-        save(featurepointimage, featurepointfile, maskh)
+    # draw the samples of all cases in parallel threads (the numpy operations and the file io release the GIL);
+    # each case draws from its own random state, seeded from the global one, to be reproducible via numpy.random.seed
+    nsamplescases = [nsamplescase] * (ncases - 1) + [nsamplescase + nsamples % ncases]
+    seeds = numpy.random.randint(0, 2**31 - 1, ncases)
+    pool = ThreadPool(min(ncases, CPU_COUNT))
+    try:
+        selections = pool.map(lambda args: _drawsamples(*args), [(cid, quadrupel, nsamplescases[cid], min_no_of_samples_per_class_and_case, seeds[cid]) for cid, quadrupel in enumerate(featureclassquadrupel)])
 
-    # join and append feature vectors of all cases
-    fg_samples = append(*fg_samples)
-    bg_samples = append(*bg_samples)
+        # allocate the training set directly in its file (all fg samples first, then all bg samples)
+        nfgtotal = sum(len(fg_sample_selection) for _, fg_sample_selection, _ in selections)
+        nbgtotal = sum(len(bg_sample_selection) for _, _, bg_sample_selection in selections)
+        nfeatures = sum(numpy.load(featurefile, mmap_mode='r').shape[1] for featurefile in selections[0][0])
+        samples_feature_vector = numpy.lib.format.open_memmap(trainingsetfile, mode='w+', dtype=dtype, shape=(nfgtotal + nbgtotal, nfeatures))
+        
+        # draw the samples from the memory-mapped features of each case into their (disjoint) slots
+        fgpositions = numpy.cumsum([0] + [len(fg_sample_selection) for _, fg_sample_selection, _ in selections])
+        bgpositions = nfgtotal + numpy.cumsum([0] + [len(bg_sample_selection) for _, _, bg_sample_selection in selections])
+        pool.map(lambda args: _gathersamples(samples_feature_vector, *args), [selection + (fgpos, bgpos) for selection, fgpos, bgpos in zip(selections, fgpositions, bgpositions)])
+    finally:
+        pool.close()
+        pool.join()
+    samples_feature_vector.flush()
     
     # build class membership    
-    samples_class_memberships = numpy.zeros(len(fg_samples) + len(bg_samples), dtype=numpy.bool)
-    samples_class_memberships[:len(fg_samples)] += numpy.ones(len(fg_samples), dtype=numpy.bool)
-    
-    # join fg and bg feature vectors
-    samples_feature_vector = append(fg_samples, bg_samples)
+    samples_class_memberships = numpy.empty(nfgtotal + nbgtotal, dtype=numpy.bool_)
+    samples_class_memberships[:nfgtotal] = True
+    samples_class_memberships[nfgtotal:] = False
     
-    # save all
-    with open(trainingsetfile, 'wb') as f:
-        numpy.save(f, samples_feature_vector)
+    # save class memberships
     with open(classsetfile, 'wb') as f:
         numpy.save(f, samples_class_memberships)
 
-def _setimagepointstwofilter(image, filter1, filter2, value):
-    r"""Set image points in ``image`` to ``value`` using two filters."""
-    __tmp = image[filter1]
-    __tmp[filter2] = value
-    image[filter1] = __tmp
-    return image
+def _drawsamples(cid, featureclassquadrupel, nsamplescase, min_no_of_samples_per_class_and_case, seed):
+    r"""
+    Draw the fg and bg sample indices of a single case of `stratifiedrandomsampling`
+    with a random state seeded by ``seed`` and save its sample point image.
+    
+    Returns
+    -------
+    featurefiles : list of strings
+        The case's feature files.
+    fg_sample_selection, bg_sample_selection : ndarray
+        The sorted indices of the drawn fg and bg samples.
+    """
+    logger = Logger.getInstance()
+    featurefiles, classfile, brainmaskfile, featurepointfile = featureclassquadrupel
+    
+    # load the class memberships and count the fg and bg voxels (once)
+    classes = numpy.load(classfile, mmap_mode='r') 
+    nfg = numpy.count_nonzero(classes)
+    nbg = classes.size - nfg
+    
+    # determine number of fg and bg samples to draw for this case
+    nbgsamples = int(float(nbg) / classes.size * nsamplescase)
+    nfgsamples = int(float(nfg) / classes.size * nsamplescase)
+    nfgsamples += nsamplescase - (nfgsamples + nbgsamples) # +/- a little
+    logger.debug('iteration {}: drawing {} fg and {} bg samples'.format(cid, nfgsamples, nbgsamples))
+    
+    # check for exceptions
+    if nfgsamples < min_no_of_samples_per_class_and_case: raise InvalidConfigurationError('Current setting would lead to a drawing of only {} fg samples for case {}!'.format(nfgsamples, classfile))
+    if nbgsamples < min_no_of_samples_per_class_and_case: raise InvalidConfigurationError('Current setting would lead to a drawing of only {} bg samples for case {}!'.format(nbgsamples, classfile))
+    if nfgsamples > nfg:
+        raise InvalidConfigurationError('Current settings would require to draw {} fg samples, but only {} present for case {}!'.format(nfgsamples, nfg, classfile))
+    if nbgsamples > nbg:
+        raise InvalidConfigurationError('Current settings would require to draw {} bg samples, but only {} present for case {}!'.format(nbgsamples, nbg, classfile))
+    
+    # get sample indices split into fg and bg indices
+    fg_samples_indices = numpy.flatnonzero(classes)
+    bg_samples_indices = numpy.flatnonzero(numpy.logical_not(classes))
+    
+    # randomly draw the required number of sample indices (sorted, for sequential reads)
+    random = numpy.random.RandomState(seed)
+    fg_sample_selection = numpy.sort(fg_samples_indices[_choice(fg_samples_indices.size, nfgsamples, random)])
+    bg_sample_selection = numpy.sort(bg_samples_indices[_choice(bg_samples_indices.size, nbgsamples, random)])
+    
+    # create and save sample point file
+    mask, maskh = load(brainmaskfile)
+    mask_indices = numpy.flatnonzero(mask)
+    featurepointimage = numpy.zeros(mask.shape, numpy.uint8)
+    featurepointimage.flat[mask_indices[fg_sample_selection]] = SAMPLEPOINT_FG_VALUE
+    featurepointimage.flat[mask_indices[bg_sample_selection]] = SAMPLEPOINT_BG_VALUE
+    save(featurepointimage, featurepointfile, maskh)
+    
+    return featurefiles, fg_sample_selection, bg_sample_selection
+
+def _gathersamples(samples_feature_vector, featurefiles, fg_sample_selection, bg_sample_selection, fgpos, bgpos):
+    r"""
+    Copy the drawn fg and bg samples of a single case from its memory-mapped feature
+    files into the training set rows starting at ``fgpos`` resp. ``bgpos``.
+    """
+    column = 0
+    for featurefile in featurefiles:
+        features = numpy.load(featurefile, mmap_mode='r')
+        samples_feature_vector[fgpos:fgpos + len(fg_sample_selection),column:column + features.shape[1]] = features[fg_sample_selection]
+        samples_feature_vector[bgpos:bgpos + len(bg_sample_selection),column:column + features.shape[1]] = features[bg_sample_selection]
+        column += features.shape[1]
+
+def _choice(n, k, random):
+    r"""
+    Randomly draw ``k`` distinct positions from ``range(n)`` using the
+    `numpy.random.RandomState` ``random``.
+    """
+    return random.permutation(n)[:k]
+
+def centerdistance_xdminus1(image, dim, voxelspacing = None, mask = None):
+    r"""
+    Distance of each voxel to the image center, ignoring dimension ``dim``.
+    
+    Equivalent to `medpy.features.intensity.centerdistance_xdminus1` for a single
+    ``dim``, but the distances are computed directly for the voxels selected by
+    ``mask`` instead of materializing a full-volume coordinate grid per axis.
+    Additionally, ``dim`` can be a sequence of dimensions, in which case the
+    distances ignoring each of them are returned as columns, as separate calls for
+    each of them would (this differs from medpy, where a sequence denotes several
+    dimensions to ignore at once).
+    
+    Note that, as in medpy, the remaining (non-singleton) axes are paired in order
+    with the leading entries of ``voxelspacing``, not with their own spacing; e.g.
+    ignoring the first dimension scales the second and third axes by the first and
+    second spacings. The values hence only correspond to physical distances for
+    isotropic spacing, but are kept this way to match the trained forests.
+    
+    Parameters
+    ----------
+    image : array_like
+        The image; only its shape is used.
+    dim : int or sequence of ints
+        The dimension(s) to ignore when computing the distance.
+    voxelspacing : sequence of floats
+        The voxel spacing of ``image``.
+    mask : array_like or None
+        A binary mask denoting the voxels for which to compute the distance. If
+        ``None``, all voxels are considered.
+        
+    Returns
+    -------
+    centerdistance : ndarray
+        The distances of the masked voxels, with one column per dimension if ``dim``
+        is a sequence.
+    """
+    shape = numpy.asarray(image).shape
+    if voxelspacing is None:
+        voxelspacing = [1.] * len(shape)
+    if mask is None:
+        mask = numpy.ones(shape, numpy.bool_)
+    offsets = [dindices - (dshape - 1) / 2. for dindices, dshape in zip(numpy.nonzero(mask), shape)]
+    if numpy.isscalar(dim):
+        return _centerdistance_xdminus1(offsets, shape, dim, voxelspacing)
+    return numpy.column_stack([_centerdistance_xdminus1(offsets, shape, d, voxelspacing) for d in dim])
+
+def _centerdistance_xdminus1(offsets, shape, dim, voxelspacing):
+    r"""
+    Distances from the voxels' center ``offsets``, ignoring dimension ``dim``. As
+    medpy squeezes the sub-volume, the remaining non-singleton axes are paired in
+    order with the leading spacings (singleton axes have zero offset).
+    """
+    axes = [d for d in range(len(shape)) if not d == dim and shape[d] > 1]
+    distances = numpy.zeros(len(offsets[0]))
+    for d, dspacing in zip(axes, voxelspacing):
+        distances += numpy.square(offsets[d] * dspacing)
+    return numpy.sqrt(distances)
+
+def local_histogram(image, bins=19, rang="image", cutoffp=(0.0, 100.0), size=5, footprint=None, output=None, mode="ignore", origin=0, mask=slice(None)):
+    r"""
+    Local histogram of each voxel's neighbourhood.
+    
+    Equivalent to `medpy.features.intensity.local_histogram`, but the image is first
+    cropped to the bounding box of ``mask``, enlarged by the filter's reach. All
+    neighbourhoods of the masked voxels lie completely inside the crop, so the results
+    are identical while the per-bin filters run over a fraction of the volume.
+    
+    See `medpy.features.intensity.local_histogram` for the parameters.
+    """
+    if isinstance(mask, slice) or footprint is not None or output is not None:
+        return intensity.local_histogram(image, bins, rang, cutoffp, size, footprint, output, mode, origin, mask)
+    mask = numpy.asarray(mask, numpy.bool_)
+    indices = numpy.nonzero(mask)
+    if 0 == len(indices[0]):
+        return intensity.local_histogram(image, bins, rang, cutoffp, size, footprint, output, mode, origin, mask)
+    reach = numpy.max(size) // 2 + numpy.max(numpy.abs(origin)) + 1
+    crop = tuple(slice(max(0, dindices.min() - reach), min(dshape, dindices.max() + reach + 1)) for dindices, dshape in zip(indices, mask.shape))
+    return intensity.local_histogram(image[crop], bins, rang, cutoffp, size, footprint, output, mode, origin, mask[crop])
 
 SAMPLERS = {'stratifiedrandomsampling': stratifiedrandomsampling}
 """The sampling methods available."""
@@ -347,8 +526,12 @@ FEATURE_CONFIG = [
     (local_histogram, [11, 'image', (0, 100), 5, None, None, 'ignore', 0], False), #11 bins, 5*2=10mm region
     (local_histogram, [11, 'image', (0, 100), 10, None, None, 'ignore', 0], False), #11 bins, 10*2=20mm region
     (local_histogram, [11, 'image', (0, 100), 15, None, None, 'ignore', 0], False), #11 bins, 15*2=30mm region
-    (centerdistance_xdminus1, [0], True),
-    (centerdistance_xdminus1, [1], True),
-    (centerdistance_xdminus1, [2], True)
+    (centerdistance_xdminus1, [(0, 1, 2)], True)
 ]
 """The features to extract."""
+
+FEATURE_NAMES = _featurenames()
+"""The names of the extracted feature columns, in order."""
+
+MASK_ONLY_FEATURES = set([centerdistance_xdminus1])
+"""The features of ``FEATURE_CONFIG`` that do not depend on the image intensities."""
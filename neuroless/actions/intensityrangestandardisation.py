@@ -19,17 +19,29 @@
 # status Development
 
 # build-in module
+import os
 import pickle
 
 # third-party modules
 from medpy.filter import IntensityRangeStandardization
 from medpy.io import load, save
 import numpy
+try:
+    from numba import njit
+except ImportError:
+    njit = None
 
 # own modules
 from .. import TaskMachine, FileSet
+from ..utilities import load_mask
 
 # constants
+CONDENSE_MIN_SAMPLES = 100000
+"""The minimal number of voxels from which to estimate the condense percentiles."""
+CONDENSE_SEED = 0
+"""The fixed seed of the sub-sampling in `_condenselimits`, keeping the trained models repeatable."""
+_modelcache = dict()
+"""Per-process cache of the loaded models, by model file."""
 
 # code
 def percentilemodelapplication(directory, inset, brainmasks, models):
@@ -59,12 +71,12 @@ def percentilemodelapplication(directory, inset, brainmasks, models):
     # prepare output
     resultset = FileSet.fromfileset(directory, inset)
 
-    # register model training & model application tasks
-    for sequence in inset.identifiers:
-        modelfile = models.getfile(identifier=sequence)
-        for case in inset.cases:
+    # register model application tasks (case-wise, so that consecutive tasks share the brain mask)
+    for case in inset.cases:
+        brainmaskfile = brainmasks.getfile(case=case)
+        for sequence in inset.identifiers:
+            modelfile = models.getfile(identifier=sequence)
             imagefile = inset.getfile(identifier=sequence, case=case)
-            brainmaskfile = brainmasks.getfile(case=case)
             destfile = resultset.getfile(identifier=sequence, case=case)
             tm.register([imagefile, brainmaskfile, modelfile],
                         [destfile],
@@ -145,24 +157,25 @@ def _percentilemodelapplication(imagefile, brainmaskfile, destfile, modelfile):
     image, header = load(imagefile)
         
     # loading brainmask
-    mask = load(brainmaskfile)[0].astype(numpy.bool)
+    mask = load_mask(brainmaskfile)
     
     # load model
-    with open(modelfile, 'rb') as f:
-        model = pickle.load(f)
+    model = _loadmodel(modelfile)
         
     # apply model
-    transformed_image = model.transform(image[mask])
+    transformed_image = model.transform(image[mask]).astype(numpy.float32, copy=False)
     
     # condense outliers in the image (extreme peak values at both end-points of the histogram)
-    transformed_image = _condense(transformed_image)
-    
-    # modify original image
-    image[~mask] = 0
-    image[mask] = transformed_image
+    # and write the transformed values into an otherwise empty image
+    result = numpy.zeros(image.shape, image.dtype)
+    if njit is not None:
+        li = _condenselimits(transformed_image)
+        _scatterclipped(numpy.ravel(mask), transformed_image, li[0], li[1], result.ravel())
+    else:
+        result[mask] = _condense(transformed_image)
     
     # save to destination
-    save(image, destfile, header)
+    save(result, destfile, header)
     
         
 def _percentilemodelstandardisation(trainingfiles, brainmaskfiles, destfiles, destmodel):
@@ -196,14 +209,20 @@ def _percentilemodelstandardisation(trainingfiles, brainmaskfiles, destfiles, de
         headers.append(h)
         
     # loading brainmasks
-    masks = [load(mask_name)[0].astype(numpy.bool) for mask_name in brainmaskfiles]
+    masks = [load_mask(mask_name) for mask_name in brainmaskfiles]
+        
+    # gather the masked voxels of all images in one contiguous float32 buffer
+    offsets = numpy.cumsum([0] + [numpy.count_nonzero(m) for m in masks])
+    voxels = numpy.empty(offsets[-1], dtype=numpy.float32)
+    for i, m, start, stop in zip(images, masks, offsets[:-1], offsets[1:]):
+        voxels[start:stop] = i[m]
         
     # train the model
     irs = IntensityRangeStandardization()
-    trained_model, transformed_images = irs.train_transform([i[m] for i, m in zip(images, masks)])
+    trained_model, transformed_images = irs.train_transform([voxels[start:stop] for start, stop in zip(offsets[:-1], offsets[1:])])
     
     # condense outliers in the image (extreme peak values at both end-points of the histogram)
-    transformed_images = [_condense(i) for i in transformed_images]
+    transformed_images = [_condense(i.astype(numpy.float32, copy=False)) for i in transformed_images]
     
     # saving the model
     with open(destmodel, 'wb') as f:
@@ -211,27 +230,74 @@ def _percentilemodelstandardisation(trainingfiles, brainmaskfiles, destfiles, de
     
     # save the transformed images
     for ti, i, m, h, dest in zip(transformed_images, images, masks, headers, destfiles):
-        i[~m] = 0
-        i[m] = ti
-        save(i, dest, h)
+        result = numpy.zeros_like(i)
+        result[m] = ti
+        save(result, dest, h)
+
+def _scatterclipped(mask, values, lower, upper, out):
+    r"""
+    Write the ``values``, clipped to ``[lower, upper]``, into the flat ``out`` at the
+    positions of the flat ``mask``.
+    """
+    j = 0
+    for i in range(mask.shape[0]):
+        if mask[i]:
+            out[i] = min(upper, max(lower, values[j]))
+            j += 1
+if njit is not None:
+    _scatterclipped = njit(cache=True)(_scatterclipped)
+
+def _loadmodel(modelfile):
+    r"""
+    Load a pickled intensity range standardisation model. The models are kept per
+    process and returned again as long as their file is unchanged.
+    """
+    mtime = os.path.getmtime(modelfile)
+    if not modelfile in _modelcache or not mtime == _modelcache[modelfile][0]:
+        with open(modelfile, 'rb') as f:
+            _modelcache[modelfile] = (mtime, pickle.load(f))
+    return _modelcache[modelfile][1]
 
 def _condense(img):
     r"""
     Apply a percentile threshold to an image, condensing all outliers to the
-    percentile values 1 and 99.9 respectively.
+    percentile values 1 and 99.9 respectively. The image is modified in place.
     
     Parameters
     ----------
-    img : array_like
+    img : ndarray
         The image whose outliers to condense.
         
     Returns
     -------
     out : ndarray
-        The resulting image.
+        The resulting image, i.e. ``img``.
+    """
+    li = _condenselimits(img)
+    return numpy.clip(img, li[0], li[1], out=img)
+
+def _condenselimits(img):
+    r"""
+    The 1 and 99.9 percentiles of ``img``. For images larger than
+    `CONDENSE_MIN_SAMPLES`, they are estimated from a random sub-sample of 1% of the
+    voxels, but at least `CONDENSE_MIN_SAMPLES` of them, drawn with the fixed seed
+    `CONDENSE_SEED` (independent of the global random state).
+    """
+    flat = numpy.ravel(img)
+    nsamples = max(CONDENSE_MIN_SAMPLES, flat.size // 100)
+    if flat.size > nsamples:
+        flat = flat[numpy.sort(numpy.random.RandomState(CONDENSE_SEED).randint(0, flat.size, nsamples))]
+    return _percentiles(flat, (1, 99.9))
+
+def _percentiles(arr, q):
+    r"""
+    Percentiles ``q`` of ``arr``, linearly interpolated as by `numpy.percentile`, but
+    found by partitioning around the required positions instead of sorting ``arr``.
     """
-    out = img.copy()
-    li = numpy.percentile(out, (1, 99.9))
-    out[out < li[0]] = li[0]
-    out[out > li[1]] = li[1]
-    return out
+    arr = numpy.asarray(arr).ravel()
+    positions = numpy.asarray(q, numpy.float64) / 100. * (arr.size - 1)
+    lower = numpy.floor(positions).astype(numpy.intp)
+    upper = numpy.ceil(positions).astype(numpy.intp)
+    part = numpy.partition(arr, numpy.unique(numpy.concatenate((lower, upper))))
+    weights = positions - lower
+    return part[lower] * (1. - weights) + part[upper] * weights
@@ -19,12 +19,17 @@
 # status Development
 
 # build-in module
+import math
 
 # third-party modules
 import numpy
-from scipy.ndimage.morphology import binary_fill_holes
+from scipy.ndimage.morphology import binary_fill_holes, generate_binary_structure
 from medpy.io import load, header, save
 from medpy.filter.binary import size_threshold
+try:
+    import cc3d
+except ImportError:
+    cc3d = None
 
 # own modules
 from .. import FileSet, TaskMachine
@@ -74,28 +79,42 @@ def _postprocess(src, dest, threshold):
     """
     # load source image
     img, hdr = load(src)
-    img = img.astype(numpy.bool)
+    img = numpy.ascontiguousarray(img, numpy.bool_)
     
-    # fill holes in 3D
-    img = binary_fill_holes(img)
+    # fill holes in 3D (in place)
+    binary_fill_holes(img, output=img)
     # adapt threshold by voxel spacing
     threshold /= numpy.prod(header.get_pixel_spacing(hdr))
     # threshold binary objects
-    out = size_threshold(img, threshold, 'lt')
+    out = _sizethreshold(img, threshold)
     # reset if last object has been removed
-    if 0 == numpy.count_nonzero(out):
+    if not out.any(): # stops at the first object voxel
         out = img
-    # fill holes in 2d
-    out = _fill2d(out)
+    # fill holes in 2d (in place)
+    _fill2d(out, output=out)
     
     # save
     save(out, dest, hdr, True)
     
-def _fill2d(arr, structure = None, dimension = 2):
+def _sizethreshold(arr, threshold):
+    r"""
+    Remove all binary objects (6-connected) with less than ``threshold`` voxels. Uses
+    *cc3d*, if available, otherwise `medpy.filter.binary.size_threshold`.
+    """
+    if cc3d is None:
+        return size_threshold(arr, threshold, 'lt')
+    return cc3d.dust(arr.view(numpy.uint8), threshold=int(math.ceil(threshold)), connectivity=6).view(numpy.bool_)
+    
+def _fill2d(arr, structure = None, dimension = 2, output = None):
     r"""
     Fill holes along a certain dimension only.
+    
+    Equivalent to filling each slice along ``dimension`` separately, but done in a
+    single call with a structuring element that is flat along ``dimension``. If
+    ``output`` is given, the result is written into it (which may be ``arr`` itself)
+    and ``output`` is returned.
     """
-    res = numpy.zeros(arr.shape, numpy.bool)
-    for sl in range(arr.shape[dimension]):    
-        res[:,:,sl] = binary_fill_holes(arr[:,:,sl], structure)
-    return res
+    if structure is None:
+        structure = generate_binary_structure(arr.ndim - 1, 1)
+    res = binary_fill_holes(arr, numpy.expand_dims(structure, dimension), output)
+    return output if output is not None else res
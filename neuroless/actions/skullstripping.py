@@ -23,18 +23,24 @@ import os
 
 # third-party modules
 from medpy.core.logger import Logger
+try:
+    from HD_BET.run import run_hd_bet
+except ImportError:
+    run_hd_bet = None
 
 # own modules
 from .. import FileSet, TaskMachine
 from ..shell import call, mv
-from ..exceptions import CommandExecutionError
+from ..exceptions import CommandExecutionError, TaskExecutionError
 
 # constants
 SEQUENCE_PREFERENCES = ['t1', 't2', 'flair']
 PREFERRED_FILE_SUFFIX = 'nii.gz'
+HDBET_DEVICE = os.environ.get('NEUROLESS_HDBET_DEVICE') or None
+"""The device on which to run *HD-BET* by default (a GPU id or ``'cpu'``, from the environment variable ``NEUROLESS_HDBET_DEVICE``); if ``None``, *FSL BET* is used."""
 
 # code
-def stripskull(directory, inset, stripsequence = False):
+def stripskull(directory, inset, stripsequence = False, hdbetdevice = HDBET_DEVICE):
     r"""
     Compute a brain mask for MR brain images.
     
@@ -47,6 +53,10 @@ def stripskull(directory, inset, stripsequence = False):
     stripsequence : False or string
         The sequence to use for computing the brain mask. If none supplied, the order
         in `~skullstripping.SEQUENCE_PREFERENCES` is respected.
+    hdbetdevice : None, integer or string
+        If not ``None``, the brain masks are computed with *HD-BET* on this device (a
+        GPU id or ``'cpu'``) instead of *FSL BET*. Note that the brain masks of the
+        training and the application should be computed with the same method.
         
     Returns
     -------
@@ -54,6 +64,12 @@ def stripskull(directory, inset, stripsequence = False):
         A FilSet centered on ``directory`` and representing the binary brain masks.
     stripsequence : string
         The sequence employed for the skull-stripping.
+        
+    Notes
+    -----
+    If ``hdbetdevice`` is set and *HD-BET* is available, all brain masks are computed
+    in a single, in-process run. Otherwise, or if *HD-BET* fails, *FSL BET* is called
+    for each case.
     """
     logger = Logger.getInstance()
     
@@ -69,17 +85,30 @@ def stripskull(directory, inset, stripsequence = False):
     elif not stripsequence in inset.identifiers:
         raise ValueError('The chosen skull-strip sequence "{}" is not available in the input image set.'.format(stripsequence))
 
-    # prepare the task machine
-    tm = TaskMachine(multiprocessing=True)
-        
     # prepare output
     resultset = FileSet(directory, inset.cases, False, ['{}.{}'.format(cid, PREFERRED_FILE_SUFFIX) for cid in inset.cases], 'cases', False)
 
-    # prepare and register skull-stripping tasks
-    for case in inset.cases:
-        src = inset.getfile(case=case, identifier=stripsequence)
-        dest = resultset.getfile(case=case)
-        rfile = dest.replace('.{}'.format(PREFERRED_FILE_SUFFIX),  '_mask.{}'.format(PREFERRED_FILE_SUFFIX)) 
+    # collect all file paths at once (both file sets are ordered by case)
+    srcs = inset.getfiles(identifier=stripsequence)
+    dests = resultset.getfiles()
+    rfiles = [dest.replace('.{}'.format(PREFERRED_FILE_SUFFIX),  '_mask.{}'.format(PREFERRED_FILE_SUFFIX)) for dest in dests]
+    
+    # if requested, compute all brain masks in a single, in-process HD-BET run
+    if hdbetdevice is not None:
+        if run_hd_bet is None:
+            logger.warning('HD-BET requested, but not available. Falling back to BET.')
+        else:
+            tm = TaskMachine(multiprocessing=False)
+            tm.register(srcs, dests, brainmasks, [srcs, dests, rfiles], dict(device=_hdbetdevice(hdbetdevice)), 'skull-strip')
+            try:
+                tm.run()
+                return resultset, stripsequence
+            except TaskExecutionError as e:
+                logger.warning('HD-BET failed, falling back to BET. Reason: {}'.format(e))
+    
+    # prepare and register skull-stripping tasks (the single-threaded BET calls run in parallel)
+    tm = TaskMachine(multiprocessing=True)
+    for src, dest, rfile in zip(srcs, dests, rfiles):
         tm.register([src], [dest], brainmask, [src, dest, rfile], dict(), 'skull-strip')
         
     # run
@@ -110,3 +139,28 @@ def brainmask(src, dest, resultfile):
         
     # copy
     mv(resultfile, dest)
+        
+def brainmasks(srcs, dests, resultfiles, device = 0):
+    r"""
+    Computes the brain masks of a number of images in a single *HD-BET* run.
+    
+    Parameters
+    ----------
+    srcs : sequence of strings
+        Paths to the images on which to compute the brain masks.
+    dests : sequence of strings
+        Target locations for the brain masks.
+    resultfiles : sequence of strings
+        The actual result files created by *HD-BET*.
+    device : integer or string
+        The GPU id or ``'cpu'``.
+    """
+    run_hd_bet(srcs, dests, mode='fast', device=device, do_tta=False, keep_mask=True, overwrite=True)
+    
+    # replace the skull-stripped images by the masks
+    for resultfile, dest in zip(resultfiles, dests):
+        mv(resultfile, dest)
+        
+def _hdbetdevice(device):
+    r"""Convert a GPU id given as string (e.g. from the environment) to an integer."""
+    return int(device) if str(device).isdigit() else device
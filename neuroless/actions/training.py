@@ -53,11 +53,12 @@ def trainet(trainingset, **kwargs):
     trainingfeaturesfile = trainingset.getfile(identifier='features')
     trainingclassesfile = trainingset.getfile(identifier='classes')
     
-    # loading training features
-    with open(trainingfeaturesfile, 'r') as f:
-        training_feature_vector = numpy.load(f)
+    # loading training features (memory-mapped)
+    training_feature_vector = numpy.load(trainingfeaturesfile, mmap_mode='r')
     if 1 == training_feature_vector.ndim:
         training_feature_vector = numpy.expand_dims(training_feature_vector, -1)
+    # the tree builder works on C-contiguous float32 (no copy if already so)
+    training_feature_vector = numpy.ascontiguousarray(training_feature_vector, dtype=numpy.float32)
     with open(trainingclassesfile , 'r') as f:
         training_class_vector = numpy.load(f)
 
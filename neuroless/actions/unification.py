@@ -20,22 +20,51 @@
 
 # build-in module
 import os
-import itertools
-import multiprocessing
+from multiprocessing.pool import ThreadPool
 
 # third-party modules
-from medpy import filter
+import numpy
+import nibabel
+from scipy.ndimage import zoom
 from medpy.io import header, load, save
+try:
+    import itk
+    itk.elastix_registration_method
+except (ImportError, AttributeError):
+    itk = None
+try:
+    import SimpleITK as sitk
+except ImportError:
+    sitk = None
+try:
+    import cupy
+    from cupyx.scipy import ndimage as cundimage
+except ImportError:
+    cupy = None
 
 # own modules
 from .. import FileSet, TaskMachine
-from ..shell import tmpdir, call, scp
+from ..TaskMachine import CPU_COUNT
+from ..shell import tmpdir, call, scp, smv
 from ..exceptions import CommandExecutionError
+from ..utilities import get_spacing_from_path
 
 # constants (see end of file for more constants)
+SCRATCH_DIR = '/dev/shm' if os.access('/dev/shm', os.W_OK) else None
+"""RAM-backed directory for intermediate files, if available."""
+SCP_NTHREADS = min(16, 2 * CPU_COUNT)
+"""The number of threads copying images in parallel."""
+PIGZ = next((os.path.join(d, 'pigz') for d in os.environ.get('PATH', '').split(os.pathsep) if os.access(os.path.join(d, 'pigz'), os.X_OK)), None)
+"""Path to the parallel gzip implementation *pigz*, if available."""
+PIGZ_NTHREADS = min(4, CPU_COUNT)
+"""The number of threads *pigz* compresses a re-sampled image with."""
+ELASTIX_NRESOLUTIONS = 3
+"""The default number of elastix pyramid levels (intra-session sequences are roughly aligned)."""
+ELASTIX_NITERATIONS = 150
+"""The default maximum number of elastix iterations per pyramid level."""
 
 # code
-def unify(directory, inset, fixedsequence = 'flair', targetspacing = 1):
+def unify(directory, inset, fixedsequence = 'flair', targetspacing = 1, gpu = False, scratchdir = SCRATCH_DIR, nresolutions = ELASTIX_NRESOLUTIONS, niterations = ELASTIX_NITERATIONS, sitkregistration = False):
     r"""
     Re-sample and co-register images to a common space.
     
@@ -51,12 +80,34 @@ def unify(directory, inset, fixedsequence = 'flair', targetspacing = 1):
     targetspacing : False or number or sequence of numbers
         The target spacing for all images. If ``False``, the original spacing of the
         ``fixedsequence`` image is kept; if a single number, isotropic spacing is
-        assumed; a sequence of numbers denotes custom spacing.
+        assumed; a sequence of numbers denotes custom spacing. Images already
+        displaying the target spacing are simply copied.
+    gpu : bool
+        Re-sample on the GPU, if *CuPy* is available.
+    scratchdir : string or None
+        Fast, local directory in which *elastix* places its intermediate files. If
+        ``None``, the system default temporary location is used.
+    nresolutions : integer
+        The number of image pyramid levels employed by the registration.
+    niterations : integer
+        The maximum number of optimizer iterations per pyramid level.
+    sitkregistration : bool
+        Register with *SimpleITK* instead of *elastix*, if available. Its optimizer,
+        sampling and pyramid only approximate `ELASTIX_RIGID_REGISTRATION_CNF`, hence
+        the results differ.
         
     Returns
     -------
     resultset : FileSet
         A FileSet centered on ``directory`` and representing the processed images.
+        
+    Notes
+    -----
+    If ``sitkregistration`` is set and *SimpleITK* is available, the registrations are
+    executed in-process with its ``ImageRegistrationMethod``, writing the transforms
+    in ITK format to ``dest.sitktransform.tfm``. Else, if *ITKElastix* is available,
+    they are executed in-process with `ELASTIX_RIGID_REGISTRATION_CNF`. Otherwise,
+    *elastix* is called for each registration.
     """
     # prepare the task machine
     tm = TaskMachine(multiprocessing=True)
@@ -64,28 +115,52 @@ def unify(directory, inset, fixedsequence = 'flair', targetspacing = 1):
     # prepare output file set
     resultset = FileSet.fromfileset(directory, inset)
 
-    # prepare and register re-sampling tasks
+    # copy the fixed images already displaying the target spacing (i/o-bound, in threads)
+    resamples = dict()
+    copies = []
     for case in inset.cases:
         src = inset.getfile(case=case, identifier=fixedsequence)
         dest = resultset.getfile(case=case, identifier=fixedsequence)
-        if targetspacing: # re-sample
-            tm.register([src], [dest], sresample, [src, dest, targetspacing], dict(), 're-sample')
+        if targetspacing and not _hasspacing(src, targetspacing): # re-sample
+            resamples[case] = src
         else: # simply copy
-            tm.register([src], [dest], scp, [src, dest], dict(), 'secure-copy')
-            
-    # run
-    tm.run()            
+            copies.append((src, dest))
+    _scpall(copies)
 
-    # prepare and register registration task
-    for case, identifier in itertools.product(inset.cases, inset.identifiers):
-        if identifier == fixedsequence: continue
-        moving = inset.getfile(case=case, identifier=identifier)
-        fixed = resultset.getfile(case=case, identifier=fixedsequence)
-        dest = resultset.getfile(case=case, identifier=identifier)
-        tm.register([moving, fixed], [dest], register, [fixed, moving, dest], dict(), 'rigid-registration')
-       
-    # run
-    tm.run()
+    # write the registration configuration file once for all registration tasks
+    with tmpdir() as t:
+        cnf_file = os.path.join(t, 'rigid_cnf.txt')
+        with open(cnf_file, 'w') as f:
+            f.write(ELASTIX_RIGID_REGISTRATION_CNF % dict(nresolutions=nresolutions, niterations=niterations))
+
+        # budget the registration threads by the number of concurrent tasks
+        movingidentifiers = [identifier for identifier in inset.identifiers if not identifier == fixedsequence]
+        threads = max(1, CPU_COUNT // max(1, min(tm.nworkers, len(inset.cases))))
+
+        # prepare and register one task per case, which re-samples the fixed image (if
+        # required) and then registers the case's other sequences to it; hence, the
+        # registrations of a case do not wait for the re-sampling of all other cases
+        for case in inset.cases:
+            fixed = resultset.getfile(case=case, identifier=fixedsequence)
+            movings = [inset.getfile(case=case, identifier=identifier) for identifier in movingidentifiers]
+            dests = [resultset.getfile(case=case, identifier=identifier) for identifier in movingidentifiers]
+            if not movings:
+                fn, args, kwargs = None, [], dict()
+            elif sitkregistration and sitk is not None:
+                fn, args, kwargs = _sitkregister, [fixed, movings, dests], dict(nresolutions=nresolutions, niterations=niterations, threads=threads)
+            elif itk is not None:
+                fn, args, kwargs = _itkregister, [fixed, movings, dests, cnf_file], dict(threads=threads)
+            else:
+                fn, args, kwargs = _elastixregister, [fixed, movings, dests], dict(cnf_file=cnf_file, scratchdir=scratchdir, threads=threads)
+            if case in resamples and not os.path.isfile(fixed):
+                src = resamples[case]
+                tm.register([src] + movings, [fixed] + dests, _resampleandregister, [src, fixed, targetspacing, gpu, fn, args, kwargs], dict(), 're-sample and rigid-registration')
+            elif movings:
+                tm.register([fixed] + movings, dests, fn, args, kwargs, 'rigid-registration')
+            # else: the fixed image exists and there is nothing to register to it
+           
+        # run
+        tm.run()
     
     return resultset
 
@@ -129,7 +204,7 @@ def resamplebyexample(directory, inset, referenceset, referenceidentifier = Fals
 
     return resultset        
 
-def resample(directory, inset, targetspacing = 1, order = 3):
+def resample(directory, inset, targetspacing = 1, order = 3, gpu = False):
     r"""
     Re-sample images to a new spacing.
     
@@ -142,9 +217,12 @@ def resample(directory, inset, targetspacing = 1, order = 3):
     targetspacing : False or number or sequence of numbers
         The target spacing for all images. If ``False``, the original spacing of the
         ``fixedsequence`` image is kept; if a single number, isotropic spacing is
-        assumed; a sequence of numbers denotes custom spacing.
+        assumed; a sequence of numbers denotes custom spacing. Images already
+        displaying the target spacing are simply copied.
     order : integer
         The order of the b-spline-re-sampling. Set to 1 for binary images.
+    gpu : bool
+        Re-sample on the GPU, if *CuPy* is available.
                         
     Returns
     -------
@@ -157,21 +235,23 @@ def resample(directory, inset, targetspacing = 1, order = 3):
     # prepare output file set
     resultset = FileSet.fromfileset(directory, inset)
 
-    # prepare and register re-sampling tasks
+    # prepare and register re-sampling tasks, collect the copies
+    copies = []
     for case in inset.cases:
         src = inset.getfile(case=case)
         dest = resultset.getfile(case=case)
-        if targetspacing: # re-sample
-            tm.register([src], [dest], sresample, [src, dest, targetspacing, order], dict(), 're-sample')
+        if targetspacing and not _hasspacing(src, targetspacing): # re-sample
+            tm.register([src], [dest], sresample, [src, dest, targetspacing, order], dict(gpu=gpu), 're-sample')
         else: # simply copy
-            tm.register([src], [dest], scp, [src, dest, order], dict(), 'secure-copy')
+            copies.append((src, dest))
 
-    # run
+    # run (the i/o-bound copies in threads, finished before the re-sampling processes are forked)
+    _scpall(copies)
     tm.run()
 
     return resultset
         
-def sresample(src, dest, spacing, order = 3):
+def sresample(src, dest, spacing, order = 3, gpu = False):
     r"""
     Secure-re-sample an image located at ``src`` to ``spacing`` and save it under
     ``dest``.
@@ -186,10 +266,77 @@ def sresample(src, dest, spacing, order = 3):
         The target voxel spacing.
     order : integer
         The b-spline-order as used by `scipy.ndimage.zoom`.
+    gpu : bool
+        Re-sample on the GPU, if *CuPy* is available.
+        
+    Notes
+    -----
+    If ``gpu`` is set and *CuPy* is available, the re-sampling is executed by
+    `cupyx.scipy.ndimage.zoom`. Else, if *SimpleITK* is available and supports the
+    requested ``order``, its ``ResampleImageFilter`` is used. Otherwise, the
+    re-sampling is done by `scipy.ndimage.zoom`, mirroring `medpy.filter.resample`.
+    Images already displaying ``spacing`` are copied without being decoded.
+    """
+    if _hasspacing(src, spacing):
+        scp(src, dest)
+    elif gpu and cupy is not None:
+        img, hdr, dtype = _loadfloat32(src)
+        img, hdr = _gpuresample(img, hdr, spacing, order)
+        _saveasdtype(img, dest, hdr, dtype)
+    elif sitk is not None and order in SITK_INTERPOLATORS:
+        _sitkresample(src, dest, spacing, order)
+    else:
+        img, hdr, dtype = _loadfloat32(src)
+        img, hdr = _cpuresample(img, hdr, spacing, order)
+        _saveasdtype(img, dest, hdr, dtype)
+        
+def _cpuresample(img, hdr, spacing, order):
+    r"""
+    Re-sample an image to ``spacing``, mirroring `medpy.filter.resample`. If the size
+    along one of the dimensions does not change, the image is zoomed slice-wise along
+    it, which skips the (identity) interpolation in that direction.
     """
-    img, hdr = load(src)
-    img, hdr = filter.resample(img, hdr, spacing, order)
-    save(img, dest, hdr)           
+    if numpy.isscalar(spacing):
+        spacing = [spacing] * img.ndim
+    zoom_factors = [old / float(new) for new, old in zip(spacing, header.get_pixel_spacing(hdr))]
+    shape = [int(round(osz * zf)) for osz, zf in zip(img.shape, zoom_factors)]
+    unchanged = [d for d in range(img.ndim) if shape[d] == img.shape[d]]
+    if img.ndim < 2 or not unchanged or len(unchanged) == img.ndim:
+        img = zoom(img, zoom_factors, order=order, mode='constant')
+    else:
+        d = unchanged[-1]
+        out = numpy.empty(shape, img.dtype)
+        for sl in range(img.shape[d]):
+            slicer = (slice(None),) * d + (sl,)
+            out[slicer] = zoom(img[slicer], zoom_factors[:d] + zoom_factors[d + 1:], order=order, mode='constant')
+        img = out
+    header.set_pixel_spacing(hdr, spacing)
+    return img, hdr
+        
+def _gpuresample(img, hdr, spacing, order):
+    r"""Re-sample an image to ``spacing`` on the GPU, mirroring `medpy.filter.resample`."""
+    if numpy.isscalar(spacing):
+        spacing = [spacing] * img.ndim
+    zoom_factors = [old / float(new) for new, old in zip(spacing, header.get_pixel_spacing(hdr))]
+    img = cupy.asnumpy(cundimage.zoom(cupy.asarray(img), zoom_factors, order=order, mode='constant'))
+    header.set_pixel_spacing(hdr, spacing)
+    return img, hdr
+        
+def _sitkresample(src, dest, spacing, order):
+    r"""Re-sample an image to ``spacing`` using SimpleITK."""
+    img = sitk.ReadImage(src)
+    if numpy.isscalar(spacing):
+        spacing = [spacing] * img.GetDimension()
+    spacing = [float(s) for s in spacing]
+    size = [int(round(osz * osp / nsp)) for osz, osp, nsp in zip(img.GetSize(), img.GetSpacing(), spacing)]
+    
+    f = sitk.ResampleImageFilter()
+    f.SetOutputSpacing(spacing)
+    f.SetSize(size)
+    f.SetOutputDirection(img.GetDirection())
+    f.SetOutputOrigin(img.GetOrigin())
+    f.SetInterpolator(SITK_INTERPOLATORS[order])
+    sitk.WriteImage(f.Execute(img), dest)
         
 def sresamplebyexample(src, dest, referenceimage, binary = False):
     r"""
@@ -206,18 +353,25 @@ def sresamplebyexample(src, dest, referenceimage, binary = False):
         Reference image displaying the target spacing, origin and size.
     binary : bool
         Set to ``True`` for binary images.
+        
+    Notes
+    -----
+    If *SimpleITK* is available, the re-sampling is executed in-process by its
+    ``ResampleImageFilter``. Otherwise, *imiImageResample* is called.
     """
+    if sitk is not None:
+        return _sitkresamplebyexample(src, dest, referenceimage, binary)
+    
     # get target voxel spacing
     refimage, refhdr = load(referenceimage)
     spacing = header.get_pixel_spacing(refhdr)
     
     with tmpdir() as t:
         # create a temporary copy of the reference image with the source image data-type (imiImageResample requires both images to be of the same dtype)
-        srcimage, _ = load(src)
-        save(refimage.astype(srcimage.dtype), os.path.join(t, 'ref.nii.gz'), refhdr)
+        save(refimage.astype(nibabel.load(src).get_data_dtype()), os.path.join(t, 'ref.nii.gz'), refhdr)
     
         # prepare and run registration command
-        cmd = ['imiImageResample', '-I', src, '-O', dest, '-R', os.path.join(t, 'ref.nii.gz'), '-s'] + map(str, spacing)
+        cmd = ['imiImageResample', '-I', src, '-O', dest, '-R', os.path.join(t, 'ref.nii.gz'), '-s'] + ['{:.12g}'.format(s) for s in spacing]
         if binary:
             cmd += ['-b']
         rtcode, stdout, stderr = call(cmd)
@@ -226,7 +380,83 @@ def sresamplebyexample(src, dest, referenceimage, binary = False):
     if not os.path.isfile(dest):
         raise CommandExecutionError(cmd, rtcode, stdout, stderr, 'Binary re-sampling result image not created.')
         
-def register(fixed, moving, dest):
+def _sitkresamplebyexample(src, dest, referenceimage, binary):
+    r"""Re-sample an image into the geometry of ``referenceimage`` using SimpleITK."""
+    f = sitk.ResampleImageFilter()
+    f.SetReferenceImage(sitk.ReadImage(referenceimage))
+    f.SetInterpolator(sitk.sitkNearestNeighbor if binary else sitk.sitkBSpline)
+    sitk.WriteImage(f.Execute(sitk.ReadImage(src)), dest)
+        
+def _scpall(copies):
+    r"""
+    Secure-copy all ``(src, dest)`` pairs of ``copies`` in a thread pool. As for tasks,
+    destinations that already exist are skipped. All copies have finished (and the
+    threads have ended) on return, hence processes can be forked safely afterwards.
+    """
+    if not copies:
+        return
+    pool = ThreadPool(min(len(copies), SCP_NTHREADS))
+    try:
+        pool.map(lambda pair: os.path.isfile(pair[1]) or scp(*pair), copies)
+    finally:
+        pool.close()
+        pool.join()
+        
+def _loadfloat32(path):
+    r"""
+    Load the image located at ``path`` as single precision array, memory-mapped if the
+    file is uncompressed. Returns the array, the header and the on-disk data-type.
+    """
+    hdr = nibabel.load(path)
+    return numpy.asarray(hdr.dataobj, numpy.float32), hdr, hdr.get_data_dtype()
+
+def _saveasdtype(img, dest, hdr, dtype):
+    r"""
+    Save ``img`` under ``dest`` cast back to ``dtype`` (see `_castasdtype`). Gzipped
+    images are compressed with *pigz*, if available.
+    """
+    img = _castasdtype(img, dtype)
+    if PIGZ is None or not dest.endswith('.gz'):
+        return save(img, dest, hdr)
+    
+    # write uncompressed, then compress with multiple threads
+    with tmpdir() as t:
+        tmp = os.path.join(t, os.path.basename(dest)[:-len('.gz')])
+        save(img, tmp, hdr)
+        cmd = [PIGZ, '-p', str(PIGZ_NTHREADS), tmp]
+        rtcode, stdout, stderr = call(cmd)
+        if not os.path.isfile(tmp + '.gz'):
+            raise CommandExecutionError(cmd, rtcode, stdout, stderr, 'Compressed image not created.')
+        smv(tmp + '.gz', dest)
+        
+def _castasdtype(img, dtype):
+    r"""
+    Cast ``img`` to ``dtype``. For integer types, the values are rounded and clipped to
+    the type's range (as scipy does for integer outputs), so that the over- and
+    undershoots of the spline interpolation do not wrap around.
+    """
+    if numpy.issubdtype(dtype, numpy.integer):
+        info = numpy.iinfo(dtype)
+        img = numpy.clip(numpy.rint(img), info.min, info.max)
+    return img.astype(dtype, copy=False)
+        
+def _resampleandregister(src, fixed, spacing, gpu, fn, args, kwargs):
+    r"""
+    Secure-re-sample ``src`` to ``spacing`` under ``fixed``, then call
+    ``fn(*args, **kwargs)`` (if not ``None``).
+    """
+    sresample(src, fixed, spacing, gpu=gpu)
+    if fn is not None:
+        fn(*args, **kwargs)
+        
+def _hasspacing(src, spacing):
+    r"""
+    Check whether the image located at ``src`` already displays the voxel ``spacing``.
+    Only the header is read, the image data is not touched.
+    """
+    return numpy.allclose(get_spacing_from_path(src), spacing, atol=1e-3)
+        
+def register(fixed, moving, dest, cnf_file = None, scratchdir = None, transformonly = False, threads = None, fixedmask = None):
     r"""
     Rigidly registers the ``moving``image to the ``fixed`` image using *elastix*, saving
     it under ``dest`.
@@ -239,32 +469,123 @@ def register(fixed, moving, dest):
         Path to the moving image.
     dest : string
         The file where to put the registered image.
+    cnf_file : string or None
+        An existing *elastix* configuration file. If ``None``, a temporary one is
+        created from `ELASTIX_RIGID_REGISTRATION_CNF` with the default number of
+        resolutions and iterations.
+    scratchdir : string or None
+        Directory in which to place the temporary *elastix* output directory. If
+        ``None``, the system default temporary location is used.
+    transformonly : bool
+        If ``True``, no registered image is written and only the transformation
+        parameter file ``dest.transparameters.txt`` is created. Unless supplied,
+        `ELASTIX_RIGID_REGISTRATION_CNF_NOIMG` is used as configuration.
+    threads : integer or None
+        The number of threads *elastix* may use. If ``None``, `CPU_COUNT`.
+    fixedmask : string or None
+        Path to a binary mask in the space of ``fixed``. If supplied, the metric is
+        only sampled inside the mask, which focuses the spatial samples on the
+        informative region.
     """
     # with temporary directory
-    with tmpdir() as t:
+    with tmpdir(scratchdir) as t:
         # prepare file paths
-        cnf_file = os.path.join(t, 'rigid_cnf.txt')
         result_file = os.path.join(t, 'result.0.nii.gz')
         transformation_file = os.path.join(t, 'TransformParameters.0.txt')
         transformation_file_to = '{}.transparameters.txt'.format(dest)
         
-        # create configuration file
-        with open(cnf_file, 'w') as f:
-            f.write(ELASTIX_RIGID_REGISTRATION_CNF)
+        # create configuration file (if not supplied)
+        if cnf_file is None:
+            cnf_file = os.path.join(t, 'rigid_cnf.txt')
+            with open(cnf_file, 'w') as f:
+                cnf = ELASTIX_RIGID_REGISTRATION_CNF_NOIMG if transformonly else ELASTIX_RIGID_REGISTRATION_CNF
+                f.write(cnf % dict(nresolutions=ELASTIX_NRESOLUTIONS, niterations=ELASTIX_NITERATIONS))
             
         # prepare and run registration command
-        cmd = ['elastix', '-f', fixed, '-m', moving, '-out', t, '-p', cnf_file, '-threads={}'.format(multiprocessing.cpu_count())]
-        rtcode, stdout, stderr = call(cmd)
+        if threads is None:
+            threads = CPU_COUNT
+        cmd = ['elastix', '-f', fixed, '-m', moving, '-out', t, '-p', cnf_file, '-threads={}'.format(threads)]
+        if fixedmask is not None:
+            cmd += ['-fMask', fixedmask]
+        rtcode, stdout, stderr = call(cmd, env=dict(os.environ, OMP_NUM_THREADS=str(threads)))
         
         # check if successful
-        if not os.path.isfile(result_file):
+        if not transformonly and not os.path.isfile(result_file):
             raise CommandExecutionError(cmd, rtcode, stdout, stderr, 'Registration result image not created.')
         elif not os.path.isfile(transformation_file):
             raise CommandExecutionError(cmd, rtcode, stdout, stderr, 'Registration transformation file not created.')
         
-        # copy
-        scp(result_file, dest)
-        scp(transformation_file, transformation_file_to)
+        # move (the temporary directory is discarded anyway)
+        if not transformonly:
+            smv(result_file, dest)
+        smv(transformation_file, transformation_file_to)
+        
+def _elastixregister(fixed, movings, dests, **kwargs):
+    r"""
+    Rigidly registers each of the ``movings`` images to the ``fixed`` image by calling
+    *elastix* (see `register`), saving them under ``dests``.
+    """
+    for moving, dest in zip(movings, dests):
+        register(fixed, moving, dest, **kwargs)
+        
+def _itkregister(fixed, movings, dests, cnf_file, threads = None):
+    r"""
+    Rigidly registers each of the ``movings`` images to the ``fixed`` image in-process
+    using *ITKElastix* and the *elastix* configuration ``cnf_file``, saving them under
+    ``dests`` and the transformations under ``dest.transparameters.txt``. The fixed
+    image is loaded only once.
+    """
+    parameterobject = itk.ParameterObject.New()
+    parameterobject.ReadParameterFile(cnf_file)
+    kwargs = dict(parameter_object=parameterobject, log_to_console=False)
+    if threads is not None:
+        kwargs['number_of_threads'] = threads
+    fixedimage = itk.imread(fixed, itk.F)
+    for moving, dest in zip(movings, dests):
+        result, transformparameters = itk.elastix_registration_method(fixedimage, itk.imread(moving, itk.F), **kwargs)
+        itk.imwrite(result, dest) # float, as the moving image is read as itk.F
+        parameterobject.WriteParameterFile(transformparameters.GetParameterMap(0), '{}.transparameters.txt'.format(dest))
+
+def _sitkregister(fixed, movings, dests, nresolutions = ELASTIX_NRESOLUTIONS, niterations = ELASTIX_NITERATIONS, threads = None):
+    r"""
+    Rigidly registers each of the ``movings`` images to the ``fixed`` image in-process
+    using *SimpleITK*, saving them under ``dests`` and the transformations (in ITK
+    format) under ``dest.sitktransform.tfm``. The fixed image is loaded only once.
+    """
+    if threads is not None:
+        sitk.ProcessObject_SetGlobalDefaultNumberOfThreads(threads)
+    fixedimage = sitk.ReadImage(fixed, sitk.sitkFloat32)
+    for moving, dest in zip(movings, dests):
+        _sitkregisterimage(fixedimage, moving, dest, nresolutions, niterations)
+        
+def _sitkregisterimage(fixedimage, moving, dest, nresolutions, niterations):
+    r"""
+    Rigidly registers the ``moving`` image to the already loaded ``fixedimage``. The
+    settings mirror `ELASTIX_RIGID_REGISTRATION_CNF`.
+    """
+    movingimage = sitk.ReadImage(moving, sitk.sitkFloat32)
+    
+    # prepare the registration
+    initialtransform = sitk.CenteredTransformInitializer(fixedimage, movingimage, sitk.Euler3DTransform(),
+                                                         sitk.CenteredTransformInitializerFilter.GEOMETRY)
+    r = sitk.ImageRegistrationMethod()
+    r.SetMetricAsMattesMutualInformation(numberOfHistogramBins=32)
+    r.SetMetricSamplingStrategy(r.RANDOM)
+    r.SetMetricSamplingPercentage(min(1., 2048. / numpy.prod(fixedimage.GetSize())))
+    r.SetInterpolator(sitk.sitkLinear)
+    r.SetOptimizerAsGradientDescent(learningRate=1.0, numberOfIterations=niterations, estimateLearningRate=r.EachIteration)
+    r.SetOptimizerScalesFromPhysicalShift()
+    r.SetShrinkFactorsPerLevel([1] * nresolutions)
+    r.SetSmoothingSigmasPerLevel([level for level in reversed(range(nresolutions))])
+    r.SetInitialTransform(initialtransform, inPlace=False)
+    
+    # register and apply
+    transform = r.Execute(fixedimage, movingimage)
+    result = sitk.Resample(movingimage, fixedimage, transform, sitk.sitkBSpline, 0., movingimage.GetPixelID())
+    
+    # save
+    sitk.WriteImage(result, dest)
+    sitk.WriteTransform(transform, '{}.sitktransform.tfm'.format(dest))
         
 ELASTIX_RIGID_REGISTRATION_CNF = \
 """
@@ -277,8 +598,8 @@ ELASTIX_RIGID_REGISTRATION_CNF = \
 (Interpolator "BSplineInterpolator")
 (ResampleInterpolator "FinalBSplineInterpolator")
 (Resampler "DefaultResampler")
-(FixedImagePyramid "FixedRecursiveImagePyramid")
-(MovingImagePyramid "MovingRecursiveImagePyramid")
+(FixedImagePyramid "FixedSmoothingImagePyramid")
+(MovingImagePyramid "MovingSmoothingImagePyramid")
 (Optimizer "AdaptiveStochasticGradientDescent")
 (Transform "EulerTransform")
 (Metric "AdvancedMattesMutualInformation")
@@ -286,8 +607,8 @@ ELASTIX_RIGID_REGISTRATION_CNF = \
 (AutomaticTransformInitialization "true")
 (HowToCombineTransforms "Compose")
 (NumberOfHistogramBins 32)
-(NumberOfResolutions 4)
-(MaximumNumberOfIterations 250)
+(NumberOfResolutions %(nresolutions)d)
+(MaximumNumberOfIterations %(niterations)d)
 (NumberOfSpatialSamples 2048)
 (NewSamplesEveryIteration "true")
 (ImageSampler "Random")
@@ -298,7 +619,15 @@ ELASTIX_RIGID_REGISTRATION_CNF = \
 (ResultImagePixelType "float")
 (ResultImageFormat "nii.gz")
 """
-"""The elastix rigid registration configuration file."""
+"""The elastix rigid registration configuration file template."""
+
+ELASTIX_RIGID_REGISTRATION_CNF_NOIMG = ELASTIX_RIGID_REGISTRATION_CNF.replace('(WriteResultImage "true")', '(WriteResultImage "false")')
+"""The elastix rigid registration configuration file template for transformation-only runs."""
+
+SITK_INTERPOLATORS = {0: sitk.sitkNearestNeighbor,
+                      1: sitk.sitkLinear,
+                      3: sitk.sitkBSpline} if sitk is not None else dict()
+"""Mapping from b-spline orders to the equivalent SimpleITK interpolators."""
             
 
         
\ No newline at end of file
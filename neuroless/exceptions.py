@@ -104,7 +104,16 @@ class CommandExecutionError(NeurolessException):
         info : string
             Additional information string describing the error in more detail.
         """
-        message = """
+        super(CommandExecutionError, self).__init__(cmd, rtcode, stdout, stderr, info)
+        self.cmd = cmd
+        self.rtcode = rtcode
+        self.stdout = stdout
+        self.stderr = stderr
+        self.info = info
+        
+    def __str__(self):
+        r"""The message is only formatted when requested."""
+        return """
         Running "{}" did not produce the expected results: {}
         Return-code:\t{}
         Stdout:
@@ -115,6 +124,4 @@ class CommandExecutionError(NeurolessException):
         -------
         {}
         -------
-        """.format(' '.join(cmd), info, rtcode, stdout, stderr)
-        super(CommandExecutionError, self).__init__(message)
-        
\ No newline at end of file
+        """.format(' '.join(self.cmd), self.info, self.rtcode, self.stdout, self.stderr)
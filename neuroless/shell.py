@@ -43,45 +43,31 @@ This package contains various function to use shell-commands in a secure manner.
 # status Development
 
 # build-in module
+from collections import deque
 from contextlib import contextmanager
 from subprocess import PIPE, Popen
+from threading import Thread
 import tempfile
+import shutil
+import errno
 import os
 
 # third-party modules
-from scipy.misc import doccer
 
 # own modules
-from .exceptions import FileSystemOperationError, CommandExecutionError
+from .exceptions import FileSystemOperationError
 
 # constants
-
-# documentation templates
-_src_doc = \
-"""src : string
-    Source file.
-"""
-_dest_doc = \
-"""dest : string
-    Destination file.
-"""
-_fsoe_exc_doc = \
-"""FileSystemOperationError
-    When the conditions for the operation are not met.
-"""
-_cee_exc_doc = \
-"""CommandExecutionError
-    When the operation failed.
-"""
-
-docdict = {'src' : _src_doc,
-           'dest' : _dest_doc,
-           'soe_exc' : _fsoe_exc_doc,
-           'cee_exc' : _cee_exc_doc}
-docfiller = doccer.filldoc(docdict)
+TMP_DIR = next((d for d in (os.environ.get('SLURM_TMPDIR'), '/dev/shm', os.environ.get('TMPDIR'))
+                if d and os.path.isdir(d) and os.access(d, os.W_OK)), None)
+"""Fast, node-local directory in which `tmpdir` creates its directories by default."""
+CALL_BUFFER_SIZE = 1 << 16
+"""The number of trailing bytes of each output stream kept by `call`."""
+_CALL_CHUNK_SIZE = 1 << 12
+"""The size of the chunks in which `call` reads the output streams."""
 
 # code
-def call(args):
+def call(args, env = None):
     r"""
     Executes the command contained in ``args``.
 
@@ -90,15 +76,17 @@ def call(args):
     args : sequence of strings
         First element of ``args`` is treated as the command to execute, all others as its
         space-separated arguments.
+    env : dict or None
+        The environment of the command. If ``None``, the current one is inherited.
     
     Returns
     -------
     rtcode : integer
         The return code received.
     stdout : string
-        The stdout buffer.
+        The stdout buffer (at most its last `CALL_BUFFER_SIZE` bytes).
     stderr : string
-        The stderr buffer.
+        The stderr buffer (at most its last `CALL_BUFFER_SIZE` bytes).
         
     Examples
     --------
@@ -106,24 +94,52 @@ def call(args):
     
     Will result in the execution of ``mv -v src.txt trg.txt``.
     """
-    p = Popen(args, stdout=PIPE, stderr=PIPE)
-    stdout, stderr = p.communicate()
-    rtcode = p.returncode
+    p = Popen(args, stdout=PIPE, stderr=PIPE, env=env)
+    tails = [deque(), deque()]
+    readers = [Thread(target=_readtail, args=(stream, tail)) for stream, tail in zip((p.stdout, p.stderr), tails)]
+    for reader in readers:
+        reader.daemon = True
+        reader.start()
+    for reader in readers:
+        reader.join()
+    rtcode = p.wait()
+    stdout, stderr = [b''.join(tail) for tail in tails]
     return rtcode, stdout, stderr
 
+def _readtail(stream, tail):
+    r"""
+    Read ``stream`` until its end, keeping only its last `CALL_BUFFER_SIZE` bytes in
+    the deque ``tail``. As reads may return partial chunks (e.g. a line of stderr), the
+    bytes are counted, not the chunks.
+    """
+    size = 0
+    for chunk in iter(lambda: os.read(stream.fileno(), _CALL_CHUNK_SIZE), b''):
+        tail.append(chunk)
+        size += len(chunk)
+        while size > CALL_BUFFER_SIZE:
+            excess = size - CALL_BUFFER_SIZE
+            if len(tail[0]) <= excess:
+                size -= len(tail.popleft())
+            else:
+                tail[0] = tail[0][excess:]
+                size -= excess
+    stream.close()
+
 def cp(src, dest):
     r"""
     Copy a file from ``src`` to ``dest``, overriding ``dest`` if it already exist.
     
     Parameters
     ----------
-    %(src)s
-    %(dest)s
+    src : string
+        Source file.
+    dest : string
+        Destination file.
     
     Raises
     ------        
-    %(soe_exc)s
-    %(cee_exc)s
+    FileSystemOperationError
+        When the conditions for the operation are not met or the operation failed.
     
     See Also
     --------
@@ -131,10 +147,27 @@ def cp(src, dest):
     """
     if not os.path.isfile(src):
         raise FileSystemOperationError('The source file "{}" does not exist.'.format(src))
-    cmd = ['cp', '-p', src, dest]
-    rtcode, stdout, stderr = call(cmd)
-    if not os.path.isfile(dest):
-        raise CommandExecutionError(cmd, rtcode, stdout, stderr, 'Destination file not created.')
+    try:
+        try:
+            _copyfilerange(src, dest)
+            shutil.copystat(src, dest)
+        except (AttributeError, OSError):
+            shutil.copy2(src, dest) # no in-kernel copy available
+    except (IOError, OSError) as e:
+        raise FileSystemOperationError('Copying "{}" to "{}" failed: {}'.format(src, dest, e))
+
+def _copyfilerange(src, dest):
+    r"""
+    Copy the content of ``src`` to ``dest`` in-kernel with ``os.copy_file_range``,
+    which shares the data blocks on copy-on-write file-systems.
+    """
+    with open(src, 'rb') as s, open(dest, 'wb') as d:
+        remaining = os.fstat(s.fileno()).st_size
+        while remaining > 0:
+            copied = os.copy_file_range(s.fileno(), d.fileno(), remaining)
+            if 0 == copied:
+                break
+            remaining -= copied
 
 def scp(src, dest):
     r"""
@@ -142,13 +175,15 @@ def scp(src, dest):
     
     Parameters
     ----------
-    %(src)s
-    %(dest)s
+    src : string
+        Source file.
+    dest : string
+        Destination file.
     
     Raises
     ------        
-    %(soe_exc)s
-    %(cee_exc)s
+    FileSystemOperationError
+        When the conditions for the operation are not met or the operation failed.
     
     See Also
     --------
@@ -164,13 +199,15 @@ def mv(src, dest):
     
     Parameters
     ----------
-    %(src)s
-    %(dest)s
+    src : string
+        Source file.
+    dest : string
+        Destination file.
     
     Raises
     ------        
-    %(soe_exc)s
-    %(cee_exc)s
+    FileSystemOperationError
+        When the conditions for the operation are not met or the operation failed.
     
     See Also
     --------
@@ -178,10 +215,15 @@ def mv(src, dest):
     """
     if not os.path.isfile(src):
         raise FileSystemOperationError('The source file "{}" does not exist.'.format(src))
-    cmd = ['mv', src, dest]
-    rtcode, stdout, stderr = call(cmd)
-    if not os.path.isfile(dest):
-        raise CommandExecutionError(cmd, rtcode, stdout, stderr, 'Destination file not created.')    
+    try:
+        try:
+            os.rename(src, dest)
+        except OSError as e:
+            if not errno.EXDEV == e.errno:
+                raise
+            shutil.move(src, dest) # across file-systems
+    except (IOError, OSError) as e:
+        raise FileSystemOperationError('Moving "{}" to "{}" failed: {}'.format(src, dest, e))
         
 def smv(src, dest):
     r"""
@@ -189,13 +231,15 @@ def smv(src, dest):
     
     Parameters
     ----------
-    %(src)s
-    %(dest)s
+    src : string
+        Source file.
+    dest : string
+        Destination file.
     
     Raises
     ------        
-    %(soe_exc)s
-    %(cee_exc)s
+    FileSystemOperationError
+        When the conditions for the operation are not met or the operation failed.
     
     See Also
     --------
@@ -236,9 +280,15 @@ def emptydircond(directory):
     OSError
         When the operation failed.
     """
-    _, _, files = os.walk(directory).next()
-    for _file in files:
-        os.remove(os.path.join(directory, _file))
+    if hasattr(os, 'scandir'):
+        for entry in os.scandir(directory):
+            if not entry.is_dir():
+                os.remove(entry.path)
+    else:
+        for _file in os.listdir(directory):
+            path = os.path.join(directory, _file)
+            if not os.path.isdir(path):
+                os.remove(path)
 
 def rmdircond(directory):
     r"""
@@ -258,11 +308,17 @@ def rmdircond(directory):
         os.rmdir(directory)
 
 @contextmanager
-def tmpdir():
+def tmpdir(directory = None):
     r"""
     Creates an (empty) temporary directory available and takes care of the clean-up
     afterwards.
     
+    Parameters
+    ----------
+    directory : string or None
+        The directory in which to create the temporary directory. If ``None``,
+        `TMP_DIR` is used, or the system default location if no such is available.
+    
     Examples
     --------
     >>> with tmpdir() as t:
@@ -271,9 +327,8 @@ def tmpdir():
     >>>    read_file_in(t)
     
     """  
-    tmpdir = tempfile.mkdtemp()
+    tmpdir = tempfile.mkdtemp(dir=directory if directory is not None else TMP_DIR)
     try:
         yield tmpdir
     finally:
-        emptydircond(tmpdir)
-        rmdircond(tmpdir)
\ No newline at end of file
+        shutil.rmtree(tmpdir, ignore_errors=True)
\ No newline at end of file
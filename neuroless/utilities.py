@@ -17,9 +17,15 @@ A number of small, internal utilities used by the NeuroLess package.
     get_qform_code
     get_sform_code
     get_affine
+    get_affine_from_path
+    get_affines
     get_qform
     get_sform
     get_diagonal
+    get_diagonal_compact
+    get_diagonals
+    get_spacing_from_path
+    load_mask
     
 """
 
@@ -44,14 +50,20 @@ A number of small, internal utilities used by the NeuroLess package.
 # status Development
 
 # build-in module
+import os
+from operator import methodcaller
 
 # third-party modules
 import numpy
-from medpy.io import header
+import nibabel
 
 # own modules
 
 # constants
+_headercache = dict()
+"""Per-process cache of the header-derived affine and spacing, keyed on file path, modification time and size."""
+_maskcache = dict()
+"""Per-process cache holding the last loaded binary mask."""
 
 # documentation templates
 
@@ -74,14 +86,70 @@ def get_qform_code(h):
 def get_sform_code(h):
     return h.get_header()['sform_code']
 
-def get_affine(h):
-    return h.get_affine()
-
-def get_qform(h):
-    return h.get_qform()
-
-def get_sform(h):
-    return h.get_sform()
-
-def get_diagonal(h):
-    return numpy.diag(list(header.get_pixel_spacing(h)) + [1])
\ No newline at end of file
+get_affine = methodcaller('get_affine')
+
+def get_affine_from_path(path):
+    return _get_pathheader(path)[0].copy()
+
+def get_affines(hs):
+    return numpy.asarray([h.get_affine() for h in hs])
+
+get_qform = methodcaller('get_qform')
+
+get_sform = methodcaller('get_sform')
+
+def get_diagonal(h, dtype = numpy.float64):
+    d = get_diagonal_compact(h, dtype)
+    out = numpy.zeros((len(d), len(d)), dtype)
+    numpy.fill_diagonal(out, d)
+    return out
+
+def get_diagonal_compact(h, dtype = numpy.float64):
+    return numpy.append(_get_spacing(h), 1.).astype(dtype, copy=False)
+
+def get_diagonals(hs, dtype = numpy.float64):
+    spacings = numpy.asarray([_get_spacing(h) for h in hs], dtype=dtype)
+    n = spacings.shape[1] + 1
+    out = numpy.zeros((len(spacings), n, n), dtype)
+    idx = numpy.arange(n - 1)
+    out[:, idx, idx] = spacings
+    out[:, -1, -1] = 1
+    return out
+
+def get_spacing_from_path(path):
+    return _get_pathheader(path)[1]
+
+def _get_pathheader(path):
+    st = os.stat(path)
+    key = (path, st.st_mtime, st.st_size)
+    if key not in _headercache: # only the header is read, not the image data
+        h = nibabel.load(path)
+        _headercache[key] = (numpy.array(h.affine), tuple(float(s) for s in _get_spacing(h)))
+    return _headercache[key]
+
+def _get_spacing(h):
+    if isinstance(h, nibabel.Nifti1Pair): # read directly from the header fields
+        hdr = h.header
+        return hdr['pixdim'][1:hdr['dim'][0] + 1]
+    from medpy.io import header # only required for non-NIfTI images
+    return header.get_pixel_spacing(h)
+
+def load_mask(path):
+    r"""
+    Load a binary mask as boolean array. Boolean and binary uint8 masks are
+    re-interpreted without a copy, all others are compared against zero. The last
+    loaded mask is kept per process and returned again as long as its file is
+    unchanged; the returned array must not be modified.
+    """
+    key = (path, os.path.getmtime(path))
+    if not key in _maskcache:
+        _maskcache.clear()
+        from medpy.io import load # as the images the masks are applied to
+        arr = load(path)[0]
+        if numpy.bool_ == arr.dtype:
+            _maskcache[key] = arr
+        elif numpy.uint8 == arr.dtype and arr.max() <= 1:
+            _maskcache[key] = arr.view(numpy.bool_)
+        else:
+            _maskcache[key] = arr != 0
+    return _maskcache[key]
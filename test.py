@@ -5,34 +5,47 @@ from neuroless.shell import tmpdir, scp, cp, mv, smv, mkdircond, emptydircond,\
     rmdircond
 from neuroless.exceptions import FileSystemOperationError
 
+def raises(exception, fun, *args):
+    try:
+        fun(*args)
+    except exception:
+        return True
+    return False
+
+def listdir(directory):
+    if hasattr(os, 'scandir'): # file types come with the directory entries
+        entries = [(e.name, e.is_dir()) for e in os.scandir(directory)]
+    else:
+        entries = [(n, os.path.isdir(os.path.join(directory, n))) for n in os.listdir(directory)]
+    return sorted(n for n, isdir in entries if isdir), sorted(n for n, isdir in entries if not isdir)
+
 with tmpdir() as t:
-    print t
-    
     cp('test.txt', os.path.join(t, 'test2.txt'))
     scp('test.txt', os.path.join(t, 'test3.txt'))
-    try:
-        scp('test.txt', os.path.join(t, 'test2.txt'))
-    except FileSystemOperationError as e:
-        print e
+    assert raises(FileSystemOperationError, scp, 'test.txt', os.path.join(t, 'test2.txt'))
     mv(os.path.join(t, 'test2.txt'), os.path.join(t, 'test3.txt'))
+    assert not os.path.exists(os.path.join(t, 'test2.txt'))
     smv(os.path.join(t, 'test3.txt'), os.path.join(t, 'test4.txt'))
-    try:
-        smv('test.txt', os.path.join(t, 'test4.txt'))
-    except FileSystemOperationError as e:
-        print e
+    assert raises(FileSystemOperationError, smv, 'test.txt', os.path.join(t, 'test4.txt'))
+    mkdircond(os.path.join(t, 'test'))
+    # creating an existing directory is silently skipped
     mkdircond(os.path.join(t, 'test'))
-    
+    assert os.path.isdir(os.path.join(t, 'test'))
+
     cp('test.txt', os.path.join(t, 'test', 'test2.txt'))
-    
-    for r, d, f in os.walk(t):
-        print r, d
-        print r, f
-    
+
+    assert listdir(t) == (['test'], ['test4.txt'])
+    assert listdir(os.path.join(t, 'test')) == ([], ['test2.txt'])
+
     emptydircond(os.path.join(t, 'test'))
     rmdircond(os.path.join(t, 'test'))
-    
-with tmpdir() as t:
-    print t
-    raise Exception()
-    
-        
+    assert not os.path.exists(os.path.join(t, 'test'))
+
+# the temporary directory is removed, even if an exception occurs
+try:
+    with tmpdir() as t:
+        raise KeyError()
+except KeyError:
+    assert not os.path.exists(t)
+else:
+    assert False
@@ -0,0 +1,17 @@
+#!/usr/bin/python
+
+import numpy
+from medpy.features import intensity
+from neuroless.actions.features import centerdistance_xdminus1
+
+# the fused centerdistance_xdminus1 columns equal the single-dimension calls and medpy
+rs = numpy.random.RandomState(0)
+for shape, voxelspacing in [((7, 9, 5), (0.9, 1.3, 3.0)), ((10, 10, 10), (1., 1., 1.))]:
+    image = rs.rand(*shape)
+    mask = rs.rand(*shape) > .4
+    fused = centerdistance_xdminus1(image, (0, 1, 2), voxelspacing, mask)
+    assert fused.shape == (numpy.count_nonzero(mask), 3)
+    for dim in range(3):
+        single = centerdistance_xdminus1(image, dim, voxelspacing, mask)
+        assert numpy.array_equal(fused[:,dim], single)
+        assert numpy.allclose(single, intensity.centerdistance_xdminus1(image, dim, voxelspacing, mask))
@@ -0,0 +1,15 @@
+#!/usr/bin/python
+
+import numpy
+from scipy.ndimage import zoom
+from neuroless.actions.unification import _castasdtype
+
+# spline undershoots at edges of an unsigned image are clipped, not wrapped around
+image = numpy.zeros((20, 20, 20), numpy.uint16)
+image[5:15,5:15,5:15] = 1000
+resampled = zoom(image.astype(numpy.float32), 1.7, order=3, mode='constant')
+assert resampled.min() < 0
+cast = _castasdtype(resampled, numpy.uint16)
+assert cast.dtype == numpy.uint16
+assert cast.min() == 0 and cast.max() <= 1000 * 1.5
+assert numpy.array_equal(cast, zoom(image, 1.7, order=3, mode='constant'))